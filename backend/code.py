@@ -1,5 +1,6 @@
 import cv2
 import numpy as np
+from itertools import compress
 import matplotlib.pyplot as plt
 
 plt.rcParams['figure.figsize'] = [12, 12]
@@ -53,12 +54,21 @@ def apply_watershed(mask_input, min_area=500, threshold_factor=0.15):
     markers = cv2.watershed(image_temp, markers)
 
     final_contours = []
-    for label in np.unique(markers):
-        if label <= 1: continue
-        
-        object_mask = np.zeros(mask_input.shape, dtype="uint8")
-        object_mask[markers == label] = 255
-        contours, _ = cv2.findContours(object_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # Caixa delimitadora de cada rótulo em uma passada; o contorno é extraído só dentro dela
+    # (com 1px de margem), em vez de uma máscara do tamanho da imagem por rótulo.
+    # O watershed marca a borda da imagem com -1, então nenhum rótulo encosta nela.
+    ys, xs = np.nonzero(markers > 1)
+    labels = markers[ys, xs]
+    n_labels = int(labels.max()) + 1 if labels.size else 0
+    y_min = np.full(n_labels, markers.shape[0]); x_min = np.full(n_labels, markers.shape[1])
+    y_max = np.full(n_labels, -1); x_max = np.full(n_labels, -1)
+    np.minimum.at(y_min, labels, ys); np.minimum.at(x_min, labels, xs)
+    np.maximum.at(y_max, labels, ys); np.maximum.at(x_max, labels, xs)
+    for label in np.flatnonzero(y_max >= 0):
+        roi = markers[y_min[label]:y_max[label] + 1, x_min[label]:x_max[label] + 1]
+        object_mask = np.zeros((roi.shape[0] + 2, roi.shape[1] + 2), dtype="uint8")
+        object_mask[1:-1, 1:-1][roi == label] = 255
+        contours, _ = cv2.findContours(object_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x_min[label]) - 1, int(y_min[label]) - 1))
         
         for contour in contours:
             if cv2.contourArea(contour) > min_area:
@@ -72,37 +82,25 @@ raw_out_contours = apply_watershed(mask_out_of_standard, min_area=300, threshold
 raw_yellow_contours = apply_watershed(mask_yellow, min_area=300, threshold_factor=0.20)
 
 # 2. Calcula Média Global e Limite de Dano
-all_detected_contours = raw_yellow_contours + raw_out_contours
+# Áreas calculadas uma única vez e reaproveitadas na média e na classificação
+yellow_areas = np.array([cv2.contourArea(cnt) for cnt in raw_yellow_contours], dtype=np.float64)
+out_areas = np.array([cv2.contourArea(cnt) for cnt in raw_out_contours], dtype=np.float64)
 avg_area = 0
 damage_threshold = 0
 
-if len(all_detected_contours) > 0:
-    all_areas = [cv2.contourArea(cnt) for cnt in all_detected_contours]
-    avg_area = np.mean(all_areas)
+if yellow_areas.size + out_areas.size > 0:
+    avg_area = np.mean(np.concatenate((yellow_areas, out_areas)))
     damage_threshold = avg_area * (2/3)
     print(f"Área Média: {avg_area:.0f} px | Limite de Dano: {damage_threshold:.0f} px")
 
-# Listas para armazenar a classificação detalhada (necessário para a lógica)
-pins_ok = []                  
-pins_wrong_color = []         
-pins_damaged_yellow = []      
-pins_double_defect = []       
-
-# A. Analisando os Amarelos
-for cnt in raw_yellow_contours:
-    area = cv2.contourArea(cnt)
-    if area < damage_threshold:
-        pins_damaged_yellow.append(cnt)
-    else:
-        pins_ok.append(cnt)
-
-# B. Analisando os de Cor Errada
-for cnt in raw_out_contours:
-    area = cv2.contourArea(cnt)
-    if area < damage_threshold:
-        pins_double_defect.append(cnt) 
-    else:
-        pins_wrong_color.append(cnt)
+# Classificação detalhada (necessária para a lógica)
+# A. Amarelos: danificados abaixo do limite  /  B. Cor errada: defeito duplo abaixo do limite
+yellow_damaged = yellow_areas < damage_threshold
+out_damaged = out_areas < damage_threshold
+pins_ok = list(compress(raw_yellow_contours, ~yellow_damaged))
+pins_wrong_color = list(compress(raw_out_contours, ~out_damaged))
+pins_damaged_yellow = list(compress(raw_yellow_contours, yellow_damaged))
+pins_double_defect = list(compress(raw_out_contours, out_damaged))
 
 # --- 4. AGRUPAMENTO PARA VISUALIZAÇÃO EM 3 CORES ---
 
@@ -1,11 +1,23 @@
 from fastapi import FastAPI, HTTPException, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Tuple
 import os
+import asyncio
 import hashlib
-from datetime import datetime
+import time
+import logging
+import threading
+from itertools import compress
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
 from supabase import create_client, Client
+from storage3.utils import StorageException
+import httpx
 import cv2
 import numpy as np
 from dotenv import load_dotenv
@@ -13,7 +25,28 @@ from shaft_processing import process_shafts_complete
 
 load_dotenv()
 
-app = FastAPI(title="HawkEye Backend API")
+# Logs de diagnóstico por arquivo ficam em DEBUG; LOG_LEVEL=DEBUG para vê-los
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger("hawkeye")
+# O cliente HTTP do Supabase registra cada requisição em INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global vision_pool
+    with vision_pool_lock:
+        vision_pool = create_vision_pool()
+    sweeper = asyncio.create_task(sweep_temp_bucket()) if TEMP_FOLDER_TTL_HOURS > 0 else None
+    yield
+    if sweeper is not None:
+        sweeper.cancel()
+    with vision_pool_lock:
+        pool, vision_pool = vision_pool, None
+    pool.shutdown(cancel_futures=True)
+
+
+app = FastAPI(title="HawkEye Backend API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,10 +61,75 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SUPABASE_BUCKET_TEMP = "pipeline-temp"
 SUPABASE_BUCKET_PERMANENT = "pipeline-permanent"
 
+# Limites de concorrência: transferências com o Supabase e pipelines de visão simultâneos
+MAX_CONCURRENT_TRANSFERS = int(os.getenv("MAX_CONCURRENT_TRANSFERS", "12"))
+# Envios das imagens processadas partem de threads de várias imagens ao mesmo tempo;
+# este limite compartilhado mantém o total dentro de MAX_CONCURRENT_TRANSFERS
+processed_upload_slots = threading.BoundedSemaphore(MAX_CONCURRENT_TRANSFERS)
+MAX_CONCURRENT_PROCESSING = int(os.getenv("MAX_CONCURRENT_PROCESSING", str(os.cpu_count() or 4)))
+# Threads do OpenCV em cada processo do pool: por padrão, os núcleos divididos entre os workers.
+# Com vários workers do uvicorn na mesma máquina, reduza para não ultrapassar o total de núcleos.
+OPENCV_THREADS_PER_WORKER = int(os.getenv("OPENCV_THREADS", "0")) or max(1, (os.cpu_count() or 1) // MAX_CONCURRENT_PROCESSING)
+
+# Falhas transitórias do Storage (rede, 429, 5xx) são repetidas com backoff exponencial
+STORAGE_RETRY_ATTEMPTS = 3
+STORAGE_RETRY_BASE_DELAY = 0.5
+
+# Menor lado a partir do qual a detecção da grade roda em resolução reduzida (2x)
+AREAS_DETECTION_MIN_SIDE = 1500
+# Redução máxima: acima de 2x linhas finas somem e bordas dos pins passam a virar linhas
+AREAS_DETECTION_MAX_SCALE = 2
+
+# Imagens geradas por captura, na ordem do pipeline (processed_{tipo}.<ext> no Storage)
+PROCESSED_IMAGE_TYPES = ("areas", "pins", "boxes", "shafts")
+
+# Formato das sobreposições: extensão, content-type e parâmetros do cv2.imencode.
+# JPEG (padrão) codifica ~3x mais rápido que PNG com arquivos ~8x menores; PNG mantém as
+# marcações sem perdas; WebP gera os menores arquivos, mas codifica ~4x mais devagar que PNG.
+PROCESSED_IMAGE_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", [cv2.IMWRITE_JPEG_QUALITY, 85, cv2.IMWRITE_JPEG_OPTIMIZE, 1]),
+    "png": (".png", "image/png", []),
+    "webp": (".webp", "image/webp", [cv2.IMWRITE_WEBP_QUALITY, 85]),
+}
+PROCESSED_IMAGE_FORMAT = os.getenv("PROCESSED_IMAGE_FORMAT", "jpeg").lower()
+if PROCESSED_IMAGE_FORMAT not in PROCESSED_IMAGE_FORMATS:
+    raise RuntimeError(f"PROCESSED_IMAGE_FORMAT deve ser um de: {', '.join(PROCESSED_IMAGE_FORMATS)}")
+PROCESSED_IMAGE_EXTENSION, PROCESSED_IMAGE_CONTENT_TYPE, PROCESSED_IMAGE_ENCODE_PARAMS = PROCESSED_IMAGE_FORMATS[PROCESSED_IMAGE_FORMAT]
+
+# Pool de processos do pipeline de visão, criado no lifespan (None = executa na própria thread)
+vision_pool: ProcessPoolExecutor | None = None
+# Protege a troca do pool quando um worker morre (OOM, falha nativa no OpenCV)
+vision_pool_lock = threading.Lock()
+
+# Máximo de caminhos aceitos pelo Storage em uma única chamada de remove()
+STORAGE_REMOVE_BATCH_SIZE = 1000
+# O list do Storage devolve no máximo 100 itens por padrão; as listagens são paginadas
+STORAGE_LIST_PAGE_SIZE = 1000
+
+# Pastas de lote no bucket temporário usam este formato de timestamp
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H-%M-%S"
+
+# Lotes temporários nunca criados/rejeitados são apagados após este prazo (0 desativa)
+TEMP_FOLDER_TTL_HOURS = float(os.getenv("TEMP_FOLDER_TTL_HOURS", "24"))
+TEMP_CLEANUP_INTERVAL_SECONDS = 3600
+
+# Janela em que um health check bem-sucedido do Supabase é reaproveitado
+HEALTH_CACHE_TTL_SECONDS = 5.0
+_last_supabase_ok = float("-inf")
+
+# Tabela defect_types é praticamente estática: carregada uma vez e reaproveitada entre lotes
+_defect_types_map: Dict[str, Any] = {}
+
+# Uploads aceitos: tipos de imagem suportados e tamanho máximo por arquivo
+VALID_IMAGE_TYPES = frozenset({"image/jpeg", "image/png", "image/webp", "image/jpg"})
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+UPLOAD_READ_CHUNK_BYTES = 1024 * 1024
+
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise RuntimeError("Variáveis SUPABASE_URL e SUPABASE_KEY devem estar definidas")
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+PUBLIC_STORAGE_URL = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/public"
 
 # ===================== CARREGAR MÁSCARA DE BORDA =====================
 
@@ -39,14 +137,14 @@ BORDER_MASK_PATH = "mascaraDaBorda.png"
 BORDER_MASK = None
 
 if os.path.exists(BORDER_MASK_PATH):
-    BORDER_MASK = cv2.imread(BORDER_MASK_PATH)
+    # Máscara binária: um canal basta e evita converter/redimensionar 3 canais a cada imagem
+    BORDER_MASK = cv2.imread(BORDER_MASK_PATH, cv2.IMREAD_GRAYSCALE)
     if BORDER_MASK is not None:
-        print(f"✅ Máscara de borda carregada: {BORDER_MASK_PATH}")
+        logger.info("✅ Máscara de borda carregada: %s", BORDER_MASK_PATH)
     else:
-        print(f"⚠️ Erro ao carregar máscara: {BORDER_MASK_PATH}")
+        logger.warning("⚠️ Erro ao carregar máscara: %s", BORDER_MASK_PATH)
 else:
-    print(f"⚠️ Máscara não encontrada: {BORDER_MASK_PATH}")
-    print(f"   O processamento continuará sem remoção de borda.")
+    logger.warning("⚠️ Máscara não encontrada: %s. O processamento continuará sem remoção de borda.", BORDER_MASK_PATH)
 
 
 
@@ -155,118 +253,241 @@ class RejectBatchRequest(BaseModel):
 
 # === FUNÇÕES UTILITÁRIAS ===
 
-def calculate_sha256(file_content: bytes) -> str:
-    return hashlib.sha256(file_content).hexdigest()
+def read_and_hash_sync(file_obj, filename: str) -> Tuple[bytes, str]:
+    # Leitura em blocos numa thread: o hash é atualizado a cada bloco, os blocos são unidos
+    # uma única vez no fim e o limite de tamanho vale mesmo sem tamanho informado no multipart
+    hasher = hashlib.sha256()
+    chunks = []
+    total = 0
+    while chunk := file_obj.read(UPLOAD_READ_CHUNK_BYTES):
+        total += len(chunk)
+        if total > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Arquivo excede {MAX_UPLOAD_BYTES // (1024 * 1024)} MB: {filename}")
+        hasher.update(chunk)
+        chunks.append(chunk)
+    return b"".join(chunks), hasher.hexdigest()
+
+async def read_and_hash(file: UploadFile) -> Tuple[bytes, str]:
+    # Leitura e hash fora do event loop, direto do arquivo temporário do upload
+    return await asyncio.to_thread(read_and_hash_sync, file.file, file.filename)
+
+def validate_upload_file(file: UploadFile) -> None:
+    # Rejeita antes de ler o corpo: tipo pelo cabeçalho e tamanho informado pelo multipart
+    if file.content_type not in VALID_IMAGE_TYPES:
+        raise HTTPException(status_code=415, detail=f"Tipo de arquivo não suportado: {file.content_type}")
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Arquivo excede {MAX_UPLOAD_BYTES // (1024 * 1024)} MB: {file.filename}")
+
+def is_transient_storage_error(error: Exception) -> bool:
+    if isinstance(error, StorageException):
+        details = error.args[0] if error.args and isinstance(error.args[0], dict) else {}
+        status = details.get("statusCode")
+        return status is None or status == 429 or int(status) >= 500
+    # httpx.TimeoutException é subclasse de TransportError (conexão, DNS, timeout)
+    if isinstance(error, httpx.TransportError):
+        return True
+    # O storage3 0.9 trata a falha de transporte dentro do _request lendo uma resposta que
+    # não existe, então ela chega como UnboundLocalError com o erro do httpx no contexto
+    if isinstance(error, UnboundLocalError) and isinstance(error.__context__, httpx.TransportError):
+        return True
+    return False
+
+def with_storage_retry(operation, *args, **kwargs):
+    for attempt in range(STORAGE_RETRY_ATTEMPTS):
+        try:
+            return operation(*args, **kwargs)
+        except Exception as e:
+            if attempt == STORAGE_RETRY_ATTEMPTS - 1 or not is_transient_storage_error(e):
+                raise
+            delay = STORAGE_RETRY_BASE_DELAY * 2 ** attempt
+            logger.warning("⚠️ Falha no Storage (%s), nova tentativa em %.1fs", e, delay)
+            time.sleep(delay)
 
 def get_public_url_from_supabase(storage_path: str, bucket: str = SUPABASE_BUCKET_TEMP) -> str:
     if not storage_path:
         return ""
-    try:
-        url = supabase.storage.from_(bucket).get_public_url(storage_path)
-        return url
-    except Exception as e:
-        print(f"Erro ao obter URL pública para {storage_path}: {e}")
-        return ""
+    # Mesma URL que o SDK monta, sem a chamada ao cliente nem o "?" final
+    return f"{PUBLIC_STORAGE_URL}/{bucket}/{storage_path.rstrip('?')}"
 
-def download_image_from_supabase(storage_path: str, bucket: str = SUPABASE_BUCKET_TEMP) -> np.ndarray:
+def download_image_from_supabase(storage_path: str, bucket: str = SUPABASE_BUCKET_TEMP) -> bytes:
+    # Devolve o arquivo ainda codificado: a decodificação acontece no processo do pipeline
     try:
-        res = supabase.storage.from_(bucket).download(storage_path)
-        nparr = np.frombuffer(res, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR) 
-        if img is None:
-            raise ValueError(f"Não foi possível decodificar: {storage_path}")
-        return img
+        return with_storage_retry(supabase.storage.from_(bucket).download, storage_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao baixar imagem: {str(e)}")
 
-def upload_processed_image_to_supabase(image: np.ndarray, timestamp: str, sha256: str, image_type: str, bucket: str = SUPABASE_BUCKET_TEMP) -> str:
+def decode_image(image_bytes: bytes) -> np.ndarray:
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Não foi possível decodificar a imagem")
+    return img
+
+def encode_processed_image(image: np.ndarray) -> bytes:
+    success, buffer = cv2.imencode(PROCESSED_IMAGE_EXTENSION, image, PROCESSED_IMAGE_ENCODE_PARAMS)
+    if not success:
+        raise ValueError("Não foi possível codificar a imagem")
+    return buffer.tobytes()
+
+def upload_processed_image_to_supabase(image_bytes: bytes, timestamp: str, sha256: str, image_type: str, bucket: str = SUPABASE_BUCKET_TEMP) -> str:
     try:
-        success, buffer = cv2.imencode('.png', image)
-        if not success:
-            raise ValueError("Não foi possível codificar a imagem")
-        image_bytes = buffer.tobytes()
-        storage_path = f"{timestamp}/{sha256}/processed_{image_type}.png"
-        supabase.storage.from_(bucket).upload(
-            path=storage_path,
-            file=image_bytes,
-            file_options={"content-type": "image/png", "upsert": "true"}
-        )
+        storage_path = f"{timestamp}/{sha256}/processed_{image_type}{PROCESSED_IMAGE_EXTENSION}"
+        with processed_upload_slots:
+            with_storage_retry(
+                supabase.storage.from_(bucket).upload,
+                path=storage_path,
+                file=image_bytes,
+                file_options={"content-type": PROCESSED_IMAGE_CONTENT_TYPE, "upsert": "true"}
+            )
         return storage_path
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao fazer upload: {str(e)}")
 
 def move_file_between_buckets(source_path: str, dest_path: str, source_bucket: str, dest_bucket: str) -> bool:
+    # Caminhos extraídos de URLs públicas podem trazer a query string vazia ("?") do SDK
+    source_path = source_path.split("?", 1)[0]
+    dest_path = dest_path.split("?", 1)[0]
     try:
-        file_data = supabase.storage.from_(source_bucket).download(source_path)
-        supabase.storage.from_(dest_bucket).upload(path=dest_path, file=file_data, file_options={"upsert": "true"})
+        # Cópia feita pelo próprio Storage, sem trafegar o arquivo pelo backend.
+        # O storage3 ainda não expõe destinationBucket em copy(), por isso a chamada direta.
+        with_storage_retry(
+            supabase.storage.from_(source_bucket)._request,
+            "POST",
+            "/object/copy",
+            json={
+                "bucketId": source_bucket,
+                "sourceKey": source_path,
+                "destinationKey": dest_path,
+                "destinationBucket": dest_bucket,
+            },
+        )
+        return True
+    except Exception as e:
+        logger.warning("Cópia no servidor falhou para %s, usando download/upload: %s", source_path, e)
+    try:
+        file_data = with_storage_retry(supabase.storage.from_(source_bucket).download, source_path)
+        with_storage_retry(supabase.storage.from_(dest_bucket).upload, path=dest_path, file=file_data, file_options={"upsert": "true"})
         return True
     except Exception as e:
-        print(f"Erro ao mover arquivo {source_path}: {str(e)}")
+        logger.error("Erro ao mover arquivo %s: %s", source_path, e)
         return False
 
+def get_defect_types_map() -> Dict[str, Any]:
+    global _defect_types_map
+    # Só guarda resultado não vazio, para não fixar um cache vazio se a tabela ainda não foi populada
+    if not _defect_types_map:
+        result = supabase.table("defect_types").select("id, code").execute()
+        _defect_types_map = {dt["code"]: dt["id"] for dt in result.data} if result.data else {}
+    return _defect_types_map
+
+def list_all_from_bucket(storage, path: str | None = None) -> List[Dict[str, Any]]:
+    entries, offset = [], 0
+    while True:
+        page = with_storage_retry(storage.list, path, options={"limit": STORAGE_LIST_PAGE_SIZE, "offset": offset})
+        entries.extend(page)
+        if len(page) < STORAGE_LIST_PAGE_SIZE:
+            return entries
+        offset += STORAGE_LIST_PAGE_SIZE
+
 def delete_folder_from_bucket(timestamp: str, bucket: str) -> bool:
     try:
-        files = supabase.storage.from_(bucket).list(timestamp)
-        for folder in files:
-            sha256_folder = folder['name']
-            inner_files = supabase.storage.from_(bucket).list(f"{timestamp}/{sha256_folder}")
-            files_to_delete = [f"{timestamp}/{sha256_folder}/{f['name']}" for f in inner_files]
-            if files_to_delete:
-                supabase.storage.from_(bucket).remove(files_to_delete)
+        storage = supabase.storage.from_(bucket)
+        folders = [f"{timestamp}/{folder['name']}" for folder in list_all_from_bucket(storage, timestamp)]
+        # Lista as subpastas (uma por sha256) em paralelo e remove tudo em lote
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TRANSFERS) as executor:
+            inner_listings = list(executor.map(lambda folder: list_all_from_bucket(storage, folder), folders))
+        files_to_delete = [
+            f"{folder}/{f['name']}"
+            for folder, inner_files in zip(folders, inner_listings)
+            for f in inner_files
+        ]
+        for start in range(0, len(files_to_delete), STORAGE_REMOVE_BATCH_SIZE):
+            with_storage_retry(storage.remove, files_to_delete[start:start + STORAGE_REMOVE_BATCH_SIZE])
         return True
     except Exception as e:
-        print(f"Erro ao deletar pasta {timestamp}: {str(e)}")
+        logger.error("Erro ao deletar pasta %s: %s", timestamp, e)
         return False
 
+def cleanup_expired_temp_folders(max_age_hours: float) -> int:
+    """Apaga do bucket temporário as pastas de lote mais antigas que max_age_hours."""
+    cutoff = datetime.now() - timedelta(hours=max_age_hours)
+    removed = 0
+    for folder in list_all_from_bucket(supabase.storage.from_(SUPABASE_BUCKET_TEMP)):
+        try:
+            created_at = datetime.strptime(folder['name'], TIMESTAMP_FORMAT)
+        except ValueError:
+            continue
+        if created_at < cutoff and delete_folder_from_bucket(folder['name'], SUPABASE_BUCKET_TEMP):
+            removed += 1
+    return removed
+
+async def sweep_temp_bucket():
+    """Tarefa de fundo: limpa periodicamente lotes abandonados no bucket temporário."""
+    while True:
+        try:
+            removed = await asyncio.to_thread(cleanup_expired_temp_folders, TEMP_FOLDER_TTL_HOURS)
+            if removed:
+                logger.info("🗑️ %d lote(s) temporário(s) expirado(s) removido(s)", removed)
+        except Exception as e:
+            logger.error("Erro na limpeza do bucket temporário: %s", e)
+        await asyncio.sleep(TEMP_CLEANUP_INTERVAL_SECONDS)
+
 
 # === PROCESSAMENTO DE IMAGEM ===
 
+# Elementos estruturantes constantes, criados uma única vez
+KERNEL_3X3 = np.ones((3, 3), np.uint8)
+KERNEL_5X5 = np.ones((5, 5), np.uint8)
+
 def process_image_areas(image: np.ndarray) -> Tuple[np.ndarray, int, List[int], List[int]]:
     if image is None:
         return np.zeros((100, 100, 3), dtype=np.uint8), 0, [], []
-    image_bgr = image.copy()
-    h, w = image_bgr.shape[:2]
+    h, w = image.shape[:2]
+    # Em fotos grandes a detecção roda em resolução reduzida e os parâmetros em pixels do
+    # Hough acompanham a escala
+    scale = min(AREAS_DETECTION_MAX_SCALE, max(1, min(h, w) // AREAS_DETECTION_MIN_SIDE))
+    image_bgr = cv2.resize(image, (w // scale, h // scale), interpolation=cv2.INTER_AREA) if scale > 1 else image
     gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
-    blur = cv2.bilateralFilter(gray, 9, 75, 75)  
+    # Gaussiano basta: a binarização de Otsu logo em seguida descarta a preservação de borda do bilateral
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
     _, mask_gray = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    mask_gray = cv2.morphologyEx(mask_gray, cv2.MORPH_CLOSE, np.ones((5,5), np.uint8))
+    # O fechamento 5x5 é dimensionado para a resolução original: na imagem reduzida ele
+    # apagaria linhas finas da grade (poucos px após a redução), então só roda sem redução
+    if scale == 1:
+        mask_gray = cv2.morphologyEx(mask_gray, cv2.MORPH_CLOSE, KERNEL_5X5)
     edges = cv2.Canny(mask_gray, 50, 150, apertureSize=3)
-    lines = cv2.HoughLinesP(edges, rho=1, theta=np.pi/180, threshold=120, minLineLength=100, maxLineGap=40)
+    lines = cv2.HoughLinesP(edges, rho=1, theta=np.pi/180, threshold=120 // scale, minLineLength=100 // scale, maxLineGap=40 // scale)
     if lines is None:
         return image.copy(), 0, [], []
-    verticais, horizontais = [], []
-    for l in lines:
-        x1, y1, x2, y2 = l[0]
-        if abs(x1 - x2) < abs(y1 - y2):
-            verticais.append(l)
-        else:
-            horizontais.append(l)
-    def agrupar_linhas(linhas, eixo='x', tol=25, min_dist=50):
-        if linhas is None or len(linhas) == 0:
+    if scale > 1:
+        lines = lines * scale
+    # Linhas empilhadas uma vez: separação e coordenadas médias calculadas em arrays
+    segmentos = lines.reshape(-1, 4)
+    eh_vertical = np.abs(segmentos[:, 0] - segmentos[:, 2]) < np.abs(segmentos[:, 1] - segmentos[:, 3])
+    verticais_x = (segmentos[eh_vertical, 0] + segmentos[eh_vertical, 2]) / 2
+    horizontais_y = (segmentos[~eh_vertical, 1] + segmentos[~eh_vertical, 3]) / 2
+    def agrupar_linhas(coords, tol=25, min_dist=50):
+        if len(coords) == 0:
             return []
-        coords = []
-        for l in linhas:
-            x1, y1, x2, y2 = l[0]
-            if eixo == 'x':
-                coords.append((x1 + x2) / 2)
-            else:
-                coords.append((y1 + y2) / 2)
-        coords = sorted(coords)
-        agrupadas, atual = [], [coords[0]]
+        coords = np.sort(coords).tolist()
+        # Média do grupo atual mantida por soma/contagem, sem recalcular np.mean a cada linha.
+        # O agrupamento segue sequencial: cada coordenada é comparada à média corrente do grupo,
+        # o que um corte por np.diff entre vizinhas não reproduz.
+        agrupadas, soma, contagem = [], coords[0], 1
         for c in coords[1:]:
-            if abs(c - np.mean(atual)) < tol:
-                atual.append(c)
+            if abs(c - soma / contagem) < tol:
+                soma += c
+                contagem += 1
             else:
-                media = int(np.mean(atual))
+                media = int(soma / contagem)
                 if not agrupadas or abs(media - agrupadas[-1]) > min_dist:
                     agrupadas.append(media)
-                atual = [c]
-        media = int(np.mean(atual))
+                soma, contagem = c, 1
+        media = int(soma / contagem)
         if not agrupadas or abs(media - agrupadas[-1]) > min_dist:
             agrupadas.append(media)
         return agrupadas
-    x_positions = agrupar_linhas(verticais, 'x', tol=25, min_dist=50)
-    y_positions = agrupar_linhas(horizontais, 'y', tol=25, min_dist=50)
+    x_positions = agrupar_linhas(verticais_x, tol=25, min_dist=50)
+    y_positions = agrupar_linhas(horizontais_y, tol=25, min_dist=50)
     if len(x_positions) < 2 or len(y_positions) < 2:
         return image.copy(), 0, x_positions, y_positions
     colunas = len(x_positions) - 1
@@ -280,11 +501,10 @@ def process_image_areas(image: np.ndarray) -> Tuple[np.ndarray, int, List[int],
     return result_image, total_compartimentos, x_positions, y_positions
 
 
-def apply_watershed(image_rgb: np.ndarray, mask_input: np.ndarray, min_area: int = 500, threshold_factor: float = 0.15) -> List[np.ndarray]:
+def apply_watershed(image: np.ndarray, mask_input: np.ndarray, min_area: int = 500, threshold_factor: float = 0.15) -> List[np.ndarray]:
     """Aplica o algoritmo Watershed para obter contornos que passaram pelo min_area."""
-    kernel = np.ones((3, 3), np.uint8)
-    opening = cv2.morphologyEx(mask_input, cv2.MORPH_OPEN, kernel, iterations=1)
-    sure_bg = cv2.dilate(opening, kernel, iterations=2)
+    opening = cv2.morphologyEx(mask_input, cv2.MORPH_OPEN, KERNEL_3X3, iterations=1)
+    sure_bg = cv2.dilate(opening, KERNEL_3X3, iterations=2)
 
     dist_transform = cv2.distanceTransform(opening, cv2.DIST_L2, 5)
     _, sure_fg = cv2.threshold(dist_transform, threshold_factor * dist_transform.max(), 255, 0)
@@ -295,17 +515,25 @@ def apply_watershed(image_rgb: np.ndarray, mask_input: np.ndarray, min_area: int
     markers = markers + 1
     markers[unknown == 255] = 0
     
-    image_temp = image_rgb.copy()
-    markers = cv2.watershed(image_temp, markers)
+    # O watershed altera apenas os marcadores; a imagem é só lida (e a ordem dos canais não importa)
+    markers = cv2.watershed(image, markers)
 
     final_contours = []
-    for label in np.unique(markers):
-        if label <= 1:
-            continue
-        
-        object_mask = np.zeros(mask_input.shape, dtype="uint8")
-        object_mask[markers == label] = 255
-        contours, _ = cv2.findContours(object_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # Caixa delimitadora de cada rótulo em uma passada; o contorno é extraído só dentro dela
+    # (com 1px de margem), em vez de uma máscara do tamanho da imagem por rótulo.
+    # O watershed marca a borda da imagem com -1, então nenhum rótulo encosta nela.
+    ys, xs = np.nonzero(markers > 1)
+    labels = markers[ys, xs]
+    n_labels = int(labels.max()) + 1 if labels.size else 0
+    y_min = np.full(n_labels, markers.shape[0]); x_min = np.full(n_labels, markers.shape[1])
+    y_max = np.full(n_labels, -1); x_max = np.full(n_labels, -1)
+    np.minimum.at(y_min, labels, ys); np.minimum.at(x_min, labels, xs)
+    np.maximum.at(y_max, labels, ys); np.maximum.at(x_max, labels, xs)
+    for label in np.flatnonzero(y_max >= 0):
+        roi = markers[y_min[label]:y_max[label] + 1, x_min[label]:x_max[label] + 1]
+        object_mask = np.zeros((roi.shape[0] + 2, roi.shape[1] + 2), dtype="uint8")
+        object_mask[1:-1, 1:-1][roi == label] = 255
+        contours, _ = cv2.findContours(object_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x_min[label]) - 1, int(y_min[label]) - 1))
         
         for contour in contours:
             if cv2.contourArea(contour) > min_area:
@@ -324,7 +552,6 @@ def process_image_pins(image: np.ndarray) -> Tuple[np.ndarray, int, List[Tuple[i
         - Lista de bounding boxes dos pins
         - Classificação detalhada dos pins
     """
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
     
     # --- MÁSCARAS HSV ---
@@ -344,42 +571,29 @@ def process_image_pins(image: np.ndarray) -> Tuple[np.ndarray, int, List[Tuple[i
     # --- APLICAR WATERSHED ---
     
     # Detecta candidatos baseados na cor
-    raw_out_contours = apply_watershed(image_rgb, mask_out_of_standard, min_area=300, threshold_factor=0.15)
-    raw_yellow_contours = apply_watershed(image_rgb, mask_yellow, min_area=300, threshold_factor=0.20)
+    raw_out_contours = apply_watershed(image, mask_out_of_standard, min_area=300, threshold_factor=0.15)
+    raw_yellow_contours = apply_watershed(image, mask_yellow, min_area=300, threshold_factor=0.20)
     
     # --- CALCULAR MÉDIA E LIMITE DE DANO ---
     
-    all_detected_contours = raw_yellow_contours + raw_out_contours
+    # Áreas calculadas uma única vez e reaproveitadas na média e na classificação
+    yellow_areas = np.array([cv2.contourArea(cnt) for cnt in raw_yellow_contours], dtype=np.float64)
+    out_areas = np.array([cv2.contourArea(cnt) for cnt in raw_out_contours], dtype=np.float64)
     avg_area = 0.0
     damage_threshold = 0.0
     
-    if len(all_detected_contours) > 0:
-        all_areas = [cv2.contourArea(cnt) for cnt in all_detected_contours]
-        avg_area = float(np.mean(all_areas))
+    if yellow_areas.size + out_areas.size > 0:
+        avg_area = float(np.mean(np.concatenate((yellow_areas, out_areas))))
         damage_threshold = avg_area * (2/3)
     
     # --- CLASSIFICAÇÃO DETALHADA (4 CATEGORIAS) ---
     
-    pins_ok = []                  # Amarelos perfeitos
-    pins_wrong_color = []         # Cor errada, mas não danificados
-    pins_damaged_yellow = []      # Amarelos danificados
-    pins_double_defect = []       # Cor errada E danificados
-    
-    # Analisando os Amarelos
-    for cnt in raw_yellow_contours:
-        area = cv2.contourArea(cnt)
-        if area < damage_threshold:
-            pins_damaged_yellow.append(cnt)
-        else:
-            pins_ok.append(cnt)
-    
-    # Analisando os de Cor Errada
-    for cnt in raw_out_contours:
-        area = cv2.contourArea(cnt)
-        if area < damage_threshold:
-            pins_double_defect.append(cnt)
-        else:
-            pins_wrong_color.append(cnt)
+    yellow_damaged = yellow_areas < damage_threshold
+    out_damaged = out_areas < damage_threshold
+    pins_ok = list(compress(raw_yellow_contours, ~yellow_damaged))               # Amarelos perfeitos
+    pins_wrong_color = list(compress(raw_out_contours, ~out_damaged))            # Cor errada, mas não danificados
+    pins_damaged_yellow = list(compress(raw_yellow_contours, yellow_damaged))    # Amarelos danificados
+    pins_double_defect = list(compress(raw_out_contours, out_damaged))           # Cor errada E danificados
     
     # --- AGRUPAMENTO PARA VISUALIZAÇÃO EM 3 CORES ---
     
@@ -399,18 +613,16 @@ def process_image_pins(image: np.ndarray) -> Tuple[np.ndarray, int, List[Tuple[i
     
     # --- DESENHAR RESULTADO ---
     
-    image_result = image_rgb.copy()
+    # Desenho direto em BGR, sem ida e volta para RGB
+    image_result_bgr = image.copy()
     
     COLOR_VALID = (0, 255, 0)        # Verde: Válido (Perfeito)
-    COLOR_INVALID = (255, 165, 0)    # Laranja: Inválido (Erro Único)
-    COLOR_CRITICAL = (255, 0, 0)     # Vermelho: Crítico (Erro Duplo)
-    
-    cv2.drawContours(image_result, final_green, -1, COLOR_VALID, 3)
-    cv2.drawContours(image_result, final_orange, -1, COLOR_INVALID, 3)
-    cv2.drawContours(image_result, final_red, -1, COLOR_CRITICAL, 3)
+    COLOR_INVALID = (0, 165, 255)    # Laranja: Inválido (Erro Único)
+    COLOR_CRITICAL = (0, 0, 255)     # Vermelho: Crítico (Erro Duplo)
     
-    # Converter de volta para BGR
-    image_result_bgr = cv2.cvtColor(image_result, cv2.COLOR_RGB2BGR)
+    cv2.drawContours(image_result_bgr, final_green, -1, COLOR_VALID, 3)
+    cv2.drawContours(image_result_bgr, final_orange, -1, COLOR_INVALID, 3)
+    cv2.drawContours(image_result_bgr, final_red, -1, COLOR_CRITICAL, 3)
     
     # --- EXTRAIR BOUNDING BOXES ---
     
@@ -441,30 +653,45 @@ def process_image_pins(image: np.ndarray) -> Tuple[np.ndarray, int, List[Tuple[i
 
 
 def process_image_boxes(image: np.ndarray, pin_boxes: List[Tuple[int, int, int, int]], x_positions: List[int], y_positions: List[int]) -> Tuple[np.ndarray, Dict[str, Any]]:
-    image_result = cv2.cvtColor(image.copy(), cv2.COLOR_BGR2RGB)
+    # Cores em BGR: a imagem é desenhada e devolvida sem conversão para RGB
+    image_result = image.copy()
     if len(x_positions) < 2 or len(y_positions) < 2:
-        return cv2.cvtColor(image_result, cv2.COLOR_RGB2BGR), {"total_boxes": 0, "empty_boxes": 0, "single_pin_boxes": 0, "multiple_pins_boxes": 0, "boxes": []}
+        return image_result, {"total_boxes": 0, "empty_boxes": 0, "single_pin_boxes": 0, "multiple_pins_boxes": 0, "boxes": []}
     x_positions = sorted(x_positions)
     y_positions = sorted(y_positions)
     boxes = []
+    box_cells = []
     for i in range(len(x_positions)-1):
         for j in range(len(y_positions)-1):
             x1, x2 = x_positions[i], x_positions[i+1]
             y1, y2 = y_positions[j], y_positions[j+1]
             boxes.append((x1, y1, x2-x1, y2-y1))
+            box_cells.append((i, j))
+    # Célula de cada pin localizada por busca binária nas linhas da grade, em vez de testar
+    # todo pin contra toda caixa. Centro sobre uma linha não conta (desigualdade estrita).
+    pins_per_cell = np.zeros((len(x_positions) - 1, len(y_positions) - 1), dtype=np.int64)
+    if pin_boxes:
+        pins = np.asarray(pin_boxes, dtype=np.int64)
+        centers_x = pins[:, 0] + pins[:, 2] // 2
+        centers_y = pins[:, 1] + pins[:, 3] // 2
+        grid_x = np.asarray(x_positions, dtype=np.int64)
+        grid_y = np.asarray(y_positions, dtype=np.int64)
+        col = np.searchsorted(grid_x, centers_x, side='left')
+        row = np.searchsorted(grid_y, centers_y, side='left')
+        inside = (col >= 1) & (col < len(grid_x)) & (row >= 1) & (row < len(grid_y))
+        col, row = col[inside], row[inside]
+        centers_x, centers_y = centers_x[inside], centers_y[inside]
+        strict = (grid_x[col] != centers_x) & (grid_y[row] != centers_y)
+        np.add.at(pins_per_cell, (col[strict] - 1, row[strict] - 1), 1)
     boxes_info_list = []
     empty_count = 0
     single_pin_count = 0
     multiple_pins_count = 0
-    for (x, y, w, h) in boxes:
-        pins_inside = 0
-        for (px, py, pw, ph) in pin_boxes:
-            cx, cy = px + pw//2, py + ph//2
-            if x < cx < x + w and y < cy < y + h:
-                pins_inside += 1
+    for (x, y, w, h), (i, j) in zip(boxes, box_cells):
+        pins_inside = int(pins_per_cell[i, j])
         if pins_inside == 0:
             status = "empty"
-            color = (255, 0, 0)
+            color = (0, 0, 255)
             empty_count += 1
         elif pins_inside == 1:
             status = "single"
@@ -472,14 +699,118 @@ def process_image_boxes(image: np.ndarray, pin_boxes: List[Tuple[int, int, int,
             single_pin_count += 1
         else:
             status = "multiple"
-            color = (255, 165, 0)
+            color = (0, 165, 255)
             multiple_pins_count += 1
         cv2.rectangle(image_result, (x, y), (x+w, y+h), color, 2)
         cv2.putText(image_result, str(pins_inside), (x + w//2 - 10, y + h//2), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
         boxes_info_list.append({"x": int(x), "y": int(y), "width": int(w), "height": int(h), "pins_count": int(pins_inside), "status": status})
-    image_result_bgr = cv2.cvtColor(image_result, cv2.COLOR_RGB2BGR)
     boxes_info = {"total_boxes": len(boxes), "empty_boxes": empty_count, "single_pin_boxes": single_pin_count, "multiple_pins_boxes": multiple_pins_count, "boxes": boxes_info_list}
-    return image_result_bgr, boxes_info
+    return image_result, boxes_info
+
+
+def init_vision_worker(opencv_threads: int) -> None:
+    # Cada processo do pool recebe sua fatia dos núcleos; sem isso o OpenCV abre um thread
+    # por núcleo em cada worker e os processos disputam a CPU entre si
+    cv2.setNumThreads(opencv_threads)
+
+
+def run_vision_pipeline(image_bytes: bytes) -> Dict[str, Any]:
+    """Decodifica a imagem, executa os pipelines de visão e devolve as imagens já codificadas.
+
+    Roda nos processos do vision_pool: entra e sai apenas bytes comprimidos, não matrizes.
+    """
+    original_image = decode_image(image_bytes)
+    
+    # Processamento de áreas
+    areas_image, areas_count, x_positions, y_positions = process_image_areas(original_image)
+    
+    # Processamento de pins
+    pins_image, pins_count, pin_boxes, pin_classification = process_image_pins(original_image)
+    
+    # Processamento de boxes
+    boxes_image, boxes_info = process_image_boxes(original_image, pin_boxes, x_positions, y_positions)
+    
+    # Processamento de hastes
+    shafts_image, shaft_classification = process_shafts_complete(
+        original_image,
+        border_mask=BORDER_MASK,
+        apply_border_centralization=True,
+        apply_border_removal=True
+    )
+    
+    processed_images = dict(zip(PROCESSED_IMAGE_TYPES, (areas_image, pins_image, boxes_image, shafts_image)))
+    return {
+        "images": {image_type: encode_processed_image(image) for image_type, image in processed_images.items()},
+        "areas_count": areas_count,
+        "pins_count": pins_count,
+        "boxes_info": boxes_info,
+        "pin_classification": pin_classification,
+        "shaft_classification": shaft_classification
+    }
+
+
+def create_vision_pool() -> ProcessPoolExecutor:
+    # Pipelines de visão rodam em processos separados para não disputar o GIL com as rotas.
+    # "spawn" evita herdar via fork as threads e locks do servidor.
+    return ProcessPoolExecutor(
+        max_workers=MAX_CONCURRENT_PROCESSING,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_vision_worker,
+        initargs=(OPENCV_THREADS_PER_WORKER,)
+    )
+
+
+def run_vision_in_pool(image_bytes: bytes) -> Dict[str, Any]:
+    """Executa o pipeline de visão no vision_pool (ou na própria thread, sem pool).
+
+    Se um worker morrer, o executor fica quebrado para sempre: o pool é trocado por um novo
+    (uma vez só, sob o lock) e apenas as imagens que estavam nele falham.
+    """
+    global vision_pool
+    pool = vision_pool
+    if pool is None:
+        return run_vision_pipeline(image_bytes)
+    try:
+        return pool.submit(run_vision_pipeline, image_bytes).result()
+    except BrokenProcessPool:
+        with vision_pool_lock:
+            if vision_pool is pool:
+                logger.error("❌ Worker do pipeline de visão encerrado inesperadamente, recriando o pool")
+                vision_pool = create_vision_pool()
+                pool.shutdown(wait=False, cancel_futures=True)
+        raise RuntimeError("O processo do pipeline de visão foi encerrado durante o processamento")
+
+
+def process_single_image(img_info: ImageProcessRequest) -> ImageProcessResult:
+    """Executa download, pipelines de visão e upload dos resultados de uma imagem."""
+    image_bytes = download_image_from_supabase(img_info.storage_path)
+    vision = run_vision_in_pool(image_bytes)
+    
+    # Upload das imagens processadas em paralelo e URLs públicas
+    image_types = list(vision["images"])
+    with ThreadPoolExecutor(max_workers=len(image_types)) as executor:
+        storage_paths = executor.map(
+            lambda image_type: upload_processed_image_to_supabase(vision["images"][image_type], img_info.timestamp, img_info.sha256, image_type),
+            image_types
+        )
+        processed_urls = {image_type: get_public_url_from_supabase(path) for image_type, path in zip(image_types, storage_paths)}
+    original_url = get_public_url_from_supabase(img_info.storage_path)
+    
+    return ImageProcessResult(
+        filename=img_info.filename, 
+        sha256=img_info.sha256, 
+        timestamp=img_info.timestamp, 
+        original_url=original_url, 
+        areas_url=processed_urls["areas"], 
+        pins_url=processed_urls["pins"], 
+        boxes_url=processed_urls["boxes"],
+        shafts_url=processed_urls["shafts"],
+        areas_count=vision["areas_count"], 
+        pins_count=vision["pins_count"], 
+        boxes_info=vision["boxes_info"],
+        pin_classification=vision["pin_classification"],
+        shaft_classification=vision["shaft_classification"]
+    )
 
 
 # === ROTAS ===
@@ -494,18 +825,21 @@ def read_root():
 
 @app.post("/upload-image/", response_model=UploadResponse)
 async def upload_image(file: UploadFile = File(...), batch_timestamp: str = None):
-    valid_types = ["image/jpeg", "image/png", "image/webp", "image/jpg"]
-    if file.content_type not in valid_types:
-        raise HTTPException(status_code=400, detail=f"Tipo de arquivo não suportado: {file.content_type}")
+    validate_upload_file(file)
+    file_content, sha256 = await read_and_hash(file)
     try:
-        file_content = await file.read()
-        sha256 = calculate_sha256(file_content)
         if batch_timestamp:
             timestamp = batch_timestamp
         else:
-            timestamp = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
+            timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
         storage_path = f"{timestamp}/{sha256}/original_{file.filename}"
-        supabase.storage.from_(SUPABASE_BUCKET_TEMP).upload(path=storage_path, file=file_content, file_options={"content-type": file.content_type, "upsert": "true"})
+        await asyncio.to_thread(
+            with_storage_retry,
+            supabase.storage.from_(SUPABASE_BUCKET_TEMP).upload,
+            path=storage_path,
+            file=file_content,
+            file_options={"content-type": file.content_type, "upsert": "true"}
+        )
         return UploadResponse(filename=file.filename, storage_path=storage_path, sha256=sha256, timestamp=timestamp)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro no upload: {str(e)}")
@@ -514,106 +848,96 @@ async def upload_image(file: UploadFile = File(...), batch_timestamp: str = None
 async def upload_batch(files: List[UploadFile] = File(...)):
     if not files:
         raise HTTPException(status_code=400, detail="Nenhum arquivo enviado")
-    batch_timestamp = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
-    uploaded_files = []
     for file in files:
-        valid_types = ["image/jpeg", "image/png", "image/webp", "image/jpg"]
-        if file.content_type not in valid_types:
-            raise HTTPException(status_code=400, detail=f"Tipo não suportado: {file.content_type}")
-        try:
-            file_content = await file.read()
-            sha256 = calculate_sha256(file_content)
-            storage_path = f"{batch_timestamp}/{sha256}/original_{file.filename}"
-            supabase.storage.from_(SUPABASE_BUCKET_TEMP).upload(path=storage_path, file=file_content, file_options={"content-type": file.content_type, "upsert": "true"})
-            uploaded_files.append({"filename": file.filename, "storage_path": storage_path, "sha256": sha256, "timestamp": batch_timestamp})
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Erro no upload de {file.filename}: {str(e)}")
+        validate_upload_file(file)
+    batch_timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TRANSFERS)
+    # Arquivos repetidos no mesmo lote (mesmo conteúdo e nome) caem no mesmo caminho:
+    # o envio é feito uma vez e os demais aguardam o mesmo resultado
+    uploads_by_path: Dict[str, asyncio.Future] = {}
+
+    async def upload_one(file: UploadFile) -> Dict[str, str]:
+        async with semaphore:
+            file_content, sha256 = await read_and_hash(file)
+            try:
+                storage_path = f"{batch_timestamp}/{sha256}/original_{file.filename}"
+                if storage_path not in uploads_by_path:
+                    uploads_by_path[storage_path] = asyncio.ensure_future(asyncio.to_thread(
+                        with_storage_retry,
+                        supabase.storage.from_(SUPABASE_BUCKET_TEMP).upload,
+                        path=storage_path,
+                        file=file_content,
+                        file_options={"content-type": file.content_type, "upsert": "true"}
+                    ))
+                await uploads_by_path[storage_path]
+                return {"filename": file.filename, "storage_path": storage_path, "sha256": sha256, "timestamp": batch_timestamp}
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Erro no upload de {file.filename}: {str(e)}")
+
+    # Todos os envios terminam antes de responder; as falhas são reunidas numa única resposta
+    results = await asyncio.gather(*(upload_one(file) for file in files), return_exceptions=True)
+    failures = [r for r in results if isinstance(r, Exception)]
+    if failures:
+        statuses = {e.status_code if isinstance(e, HTTPException) else 500 for e in failures}
+        details = [e.detail if isinstance(e, HTTPException) else str(e) for e in failures]
+        raise HTTPException(status_code=statuses.pop() if len(statuses) == 1 else 500, detail="; ".join(details))
+    uploaded_files = results
     return {"success": True, "batch_timestamp": batch_timestamp, "total_uploaded": len(uploaded_files), "files": uploaded_files}
 
 @app.post("/process-images/", response_model=ProcessImagesResponse)
 async def process_images(request: ProcessImagesRequest):
     if not request.images:
         raise HTTPException(status_code=400, detail="Nenhuma imagem para processar")
-    processed_count = 0
-    results = []
-    try: 
-        for img_info in request.images:
-            original_image = download_image_from_supabase(img_info.storage_path)
-            
-            # Processamento de áreas
-            areas_image, areas_count, x_positions, y_positions = process_image_areas(original_image)
-            
-            # Processamento de pins
-            pins_image, pins_count, pin_boxes, pin_classification = process_image_pins(original_image)
-            
-            # Processamento de boxes
-            boxes_image, boxes_info = process_image_boxes(original_image, pin_boxes, x_positions, y_positions)
-            
-            # Processamento de hastes
-            shafts_image, shaft_classification = process_shafts_complete(
-                original_image,
-                border_mask=BORDER_MASK,
-                apply_border_centralization=True,
-                apply_border_removal=True
-            )
-            
-            # Upload de imagens processadas
-            areas_path = upload_processed_image_to_supabase(areas_image, img_info.timestamp, img_info.sha256, "areas")
-            pins_path = upload_processed_image_to_supabase(pins_image, img_info.timestamp, img_info.sha256, "pins")
-            boxes_path = upload_processed_image_to_supabase(boxes_image, img_info.timestamp, img_info.sha256, "boxes")
-            shafts_path = upload_processed_image_to_supabase(shafts_image, img_info.timestamp, img_info.sha256, "shafts")
-            
-            # URLs públicas
-            original_url = get_public_url_from_supabase(img_info.storage_path)
-            areas_url = get_public_url_from_supabase(areas_path)
-            pins_url = get_public_url_from_supabase(pins_path)
-            boxes_url = get_public_url_from_supabase(boxes_path)
-            shafts_url = get_public_url_from_supabase(shafts_path)
-            
-            results.append(ImageProcessResult(
-                filename=img_info.filename, 
-                sha256=img_info.sha256, 
-                timestamp=img_info.timestamp, 
-                original_url=original_url, 
-                areas_url=areas_url, 
-                pins_url=pins_url, 
-                boxes_url=boxes_url,
-                shafts_url=shafts_url,
-                areas_count=areas_count, 
-                pins_count=pins_count, 
-                boxes_info=boxes_info,
-                pin_classification=pin_classification,
-                shaft_classification=shaft_classification
-            ))
-            processed_count += 1
-        return ProcessImagesResponse(success=True, message=f"Todas as {processed_count} imagens foram processadas", processed_count=processed_count, results=results)
-    except Exception as e:
-        if not isinstance(e, HTTPException):
-            raise HTTPException(status_code=500, detail=f"Erro ao processar: {str(e)}")
-        raise e
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PROCESSING)
+    # Imagens com o mesmo conteúdo no mesmo lote gravam os mesmos processed_*: o pipeline roda
+    # uma vez por (timestamp, sha256) e as demais reaproveitam o resultado com o próprio nome
+    results_by_key: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    async def run_pipeline(img_info: ImageProcessRequest) -> ImageProcessResult:
+        async with semaphore:
+            return await asyncio.to_thread(process_single_image, img_info)
+
+    async def process_one(img_info: ImageProcessRequest) -> ImageProcessResult:
+        key = (img_info.timestamp, img_info.sha256)
+        if key not in results_by_key:
+            results_by_key[key] = asyncio.ensure_future(run_pipeline(img_info))
+        result = await results_by_key[key]
+        return result.model_copy(update={"filename": img_info.filename, "original_url": get_public_url_from_supabase(img_info.storage_path)})
+
+    # Todas as imagens terminam antes de responder; as falhas são reunidas numa única resposta
+    results = await asyncio.gather(*(process_one(img_info) for img_info in request.images), return_exceptions=True)
+    failures = [(img_info, r) for img_info, r in zip(request.images, results) if isinstance(r, Exception)]
+    if failures:
+        statuses = {e.status_code if isinstance(e, HTTPException) else 500 for _, e in failures}
+        details = [f"{img_info.filename}: {e.detail if isinstance(e, HTTPException) else str(e)}" for img_info, e in failures]
+        raise HTTPException(status_code=statuses.pop() if len(statuses) == 1 else 500, detail=f"Erro ao processar: {'; '.join(details)}")
+    processed_count = len(results)
+    return ProcessImagesResponse(success=True, message=f"Todas as {processed_count} imagens foram processadas", processed_count=processed_count, results=results)
 
 @app.post("/api/batches/create", response_model=CreateBatchResponse)
-async def create_batch(request: CreateBatchRequest):
+def create_batch(request: CreateBatchRequest):
     try:
-        print(f"\n{'='*80}\n📦 Criando lote: {request.name}\n{'='*80}")
+        logger.info("📦 Criando lote: %s", request.name)
         if not request.captures:
             raise HTTPException(status_code=400, detail="Lote deve conter ao menos uma captura")
         timestamp = request.captures[0].original_uri.split('/')[0]
-        print(f"\n📁 Movendo arquivos...")
-        moved_captures = []
-        for capture in request.captures:
-            files_to_move = [(capture.original_uri, capture.original_uri), (capture.processed_uri, capture.processed_uri), (capture.processed_areas_uri, capture.processed_areas_uri), (capture.processed_pins_uri, capture.processed_pins_uri), (capture.processed_shaft_uri, capture.processed_shaft_uri)]
-            all_moved = True
-            for temp_path, dest_path in files_to_move:
-                if temp_path:
-                    success = move_file_between_buckets(temp_path, dest_path, SUPABASE_BUCKET_TEMP, SUPABASE_BUCKET_PERMANENT)
-                    if success:
-                        print(f"   ✅ Movido: {temp_path}")
-                    else:
-                        all_moved = False
-                        print(f"   ❌ Falha: {temp_path}")
-            if all_moved:
-                moved_captures.append(capture)
+        logger.info("📁 Movendo %d captura(s)...", len(request.captures))
+        # Todas as cópias do lote são disparadas em paralelo sobre o mesmo cliente HTTP/2
+        files_to_move = [(index, path) for index, capture in enumerate(request.captures) for path in (capture.original_uri, capture.processed_uri, capture.processed_areas_uri, capture.processed_pins_uri, capture.processed_shaft_uri) if path]
+        def move_one(item):
+            index, temp_path = item
+            success = move_file_between_buckets(temp_path, temp_path, SUPABASE_BUCKET_TEMP, SUPABASE_BUCKET_PERMANENT)
+            if success:
+                logger.debug("   ✅ Movido: %s", temp_path)
+            else:
+                logger.error("   ❌ Falha: %s", temp_path)
+            return index, success
+        failed_indexes = set()
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TRANSFERS) as executor:
+            for index, success in executor.map(move_one, files_to_move):
+                if not success:
+                    failed_indexes.add(index)
+        moved_captures = [capture for index, capture in enumerate(request.captures) if index not in failed_indexes]
         if len(moved_captures) != len(request.captures):
             raise HTTPException(status_code=500, detail=f"Erro ao mover arquivos. Movidos: {len(moved_captures)}/{len(request.captures)}")
         total_captures = len(request.captures)
@@ -621,21 +945,20 @@ async def create_batch(request: CreateBatchRequest):
         invalid_captures = total_captures - valid_captures
         total_defects = sum(c.defects_count for c in request.captures)
         quality_score = (valid_captures / total_captures * 100) if total_captures > 0 else 0
-        print(f"\n📊 Métricas: Total:{total_captures} | Válidas:{valid_captures} | Inválidas:{invalid_captures} | Defeitos:{total_defects} | Score:{quality_score:.2f}%")
-        print(f"\n💾 Criando lote no banco...")
+        logger.info("📊 Métricas: Total:%d | Válidas:%d | Inválidas:%d | Defeitos:%d | Score:%.2f%%", total_captures, valid_captures, invalid_captures, total_defects, quality_score)
+        logger.debug("💾 Criando lote no banco...")
         batch_data = {"name": request.name, "description": request.description, "total_captures": total_captures, "valid_captures": valid_captures, "invalid_captures": invalid_captures, "total_defects": total_defects, "quality_score": quality_score}
         batch_result = supabase.table("batches").insert(batch_data).execute()
         if not batch_result.data or len(batch_result.data) == 0:
             raise HTTPException(status_code=500, detail="Erro ao criar lote")
         batch_id = batch_result.data[0]["id"]
         
-        # print(f"   ✅ Lote criado: {batch_id}")
-        # print(f"\n📸 Criando captures...")
-        defect_types_result = supabase.table("defect_types").select("id, code").execute()
-        defect_types_map = {dt["code"]: dt["id"] for dt in defect_types_result.data} if defect_types_result.data else {}
+        defect_types_map = get_defect_types_map()
         
+        # Uma inserção por tabela para o lote inteiro: captures, depois compartments, depois defects
+        captures_data = []
         for capture in request.captures:
-            capture_data = {
+            captures_data.append({
                             "batch_id": batch_id, 
                             "filename": capture.filename, 
                             "sha256": capture.sha256, 
@@ -654,50 +977,47 @@ async def create_batch(request: CreateBatchRequest):
                             "has_wrong_color_pins": capture.has_wrong_color_pins,
                             "has_structure_damage": capture.has_structure_damage,
                             "has_shaft_defects": capture.has_shaft_defects
-                            }
-            
-            capture_result = supabase.table("captures").insert(capture_data).execute()
-            
-            if not capture_result.data or len(capture_result.data) == 0:
-                raise HTTPException(status_code=500, detail=f"Erro ao criar capture {capture.filename}")
-            capture_id = capture_result.data[0]["id"]
-            
-            print(f"   ✅ Capture: {capture.filename} ({capture_id})")
-            
-            compartments_map = {}
-            if capture.compartments:
-                print(f"      📦 Criando {len(capture.compartments)} compartimentos...")
-                compartments_data = [{"capture_id": capture_id, "grid_row": comp.grid_row, "grid_col": comp.grid_col, "bbox_x": comp.bbox_x, "bbox_y": comp.bbox_y, "bbox_width": comp.bbox_width, "bbox_height": comp.bbox_height, "pins_count": comp.pins_count, "is_valid": comp.is_valid, "has_defect": comp.has_defect} for comp in capture.compartments]
-                if compartments_data:
-                    comp_result = supabase.table("compartments").insert(compartments_data).execute()
-                    if comp_result.data:
-                        print(f"      ✅ {len(comp_result.data)} compartimentos criados")
-                        for comp in comp_result.data:
-                            key = (comp["grid_row"], comp["grid_col"])
-                            compartments_map[key] = comp["id"]
-            
-            defects_to_insert = []
-            
-            if capture.has_missing_pins and "MISSING_PIN" in defect_types_map:
+                            })
+        
+        captures_result = supabase.table("captures").insert(captures_data).execute()
+        
+        if not captures_result.data or len(captures_result.data) != len(request.captures):
+            raise HTTPException(status_code=500, detail="Erro ao criar captures")
+        # O PostgREST devolve as linhas na mesma ordem da inserção
+        capture_ids = [row["id"] for row in captures_result.data]
+        logger.debug("   ✅ %d captures criadas", len(capture_ids))
+        
+        # CompartmentData tem exatamente as colunas da tabela; model_dump roda no núcleo do pydantic
+        compartments_data = [{"capture_id": capture_id, **comp.model_dump()} for capture, capture_id in zip(request.captures, capture_ids) for comp in capture.compartments]
+        compartments_map = {}
+        if compartments_data:
+            logger.debug("   📦 Criando %d compartimentos...", len(compartments_data))
+            comp_result = supabase.table("compartments").insert(compartments_data).execute()
+            if comp_result.data:
+                logger.debug("   ✅ %d compartimentos criados", len(comp_result.data))
+                for comp in comp_result.data:
+                    key = (comp["capture_id"], comp["grid_row"], comp["grid_col"])
+                    compartments_map[key] = comp["id"]
+        
+        defects_to_insert = []
+        for capture, capture_id in zip(request.captures, capture_ids):
+            # Pino ausente (0) e pino extra (>1) saem de uma única passada pelos compartimentos
+            missing_type_id = defect_types_map.get("MISSING_PIN") if capture.has_missing_pins else None
+            extra_type_id = defect_types_map.get("EXTRA_PIN") if capture.has_extra_pins else None
+            if missing_type_id is not None or extra_type_id is not None:
                 for comp in capture.compartments:
                     if comp.pins_count == 0:
-                        key = (comp.grid_row, comp.grid_col)
-                        compartment_id = compartments_map.get(key)
-                        defects_to_insert.append({
-                            "capture_id": capture_id,
-                            "defect_type_id": defect_types_map["MISSING_PIN"],
-                            "compartment_id": compartment_id
-                        })
-            
-            if capture.has_extra_pins and "EXTRA_PIN" in defect_types_map:
-                for comp in capture.compartments:
-                    if comp.pins_count > 1:
-                        key = (comp.grid_row, comp.grid_col)
-                        compartment_id = compartments_map.get(key)
+                        defect_type_id = missing_type_id
+                    elif comp.pins_count > 1:
+                        defect_type_id = extra_type_id
+                    else:
+                        continue
+                    if defect_type_id is not None:
+                        key = (capture_id, comp.grid_row, comp.grid_col)
                         defects_to_insert.append({
                             "capture_id": capture_id,
-                            "defect_type_id": defect_types_map["EXTRA_PIN"],
-                            "compartment_id": compartment_id
+                            "defect_type_id": defect_type_id,
+                            "compartment_id": compartments_map.get(key)
                         })
             
             if capture.has_damaged_pins and "DAMAGED_PIN" in defect_types_map:
@@ -727,50 +1047,64 @@ async def create_batch(request: CreateBatchRequest):
                     "defect_type_id": defect_types_map["STRUCTURE_DAMAGE"],
                     "compartment_id": None
                 })
-            
-            if defects_to_insert:
-                print(f"      🔴 Criando {len(defects_to_insert)} defeitos...")
-                defects_result = supabase.table("defects").insert(defects_to_insert).execute()
-                if defects_result.data:
-                    print(f"      ✅ {len(defects_result.data)} defeitos criados")
-        print(f"\n🗑️ Deletando temporários...")
+        
+        if defects_to_insert:
+            logger.debug("   🔴 Criando %d defeitos...", len(defects_to_insert))
+            defects_result = supabase.table("defects").insert(defects_to_insert).execute()
+            if defects_result.data:
+                logger.debug("   ✅ %d defeitos criados", len(defects_result.data))
         delete_success = delete_folder_from_bucket(timestamp, SUPABASE_BUCKET_TEMP)
         if delete_success:
-            print(f"   ✅ Pasta {timestamp} deletada")
-        print(f"\n{'='*80}\n✅ LOTE CRIADO COM SUCESSO!\n{'='*80}\n")
+            logger.debug("   🗑️ Pasta temporária %s deletada", timestamp)
+        logger.info("✅ Lote criado: %s (%s)", request.name, batch_id)
         return CreateBatchResponse(success=True, message=f"Lote '{request.name}' criado com sucesso", batch_id=batch_id, total_captures=total_captures, valid_captures=valid_captures, invalid_captures=invalid_captures)
     except HTTPException:
         raise
     except Exception as e:
-        print(f"\n❌ Erro: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Erro ao criar lote: %s", e)
         raise HTTPException(status_code=500, detail=f"Erro ao criar lote: {str(e)}")
 
 @app.post("/api/batches/reject")
-async def reject_batch(request: RejectBatchRequest):
+def reject_batch(request: RejectBatchRequest):
     try:
-        print(f"\n{'='*80}\n❌ Rejeitando lote: {request.timestamp}\n{'='*80}")
-        print(f"\n🗑️ Deletando arquivos...")
+        logger.info("❌ Rejeitando lote: %s", request.timestamp)
         delete_success = delete_folder_from_bucket(request.timestamp, SUPABASE_BUCKET_TEMP)
         if not delete_success:
             raise HTTPException(status_code=500, detail=f"Erro ao deletar lote {request.timestamp}")
-        print(f"   ✅ Pasta {request.timestamp} deletada\n{'='*80}\n✅ LOTE REJEITADO!\n{'='*80}\n")
+        logger.info("✅ Lote rejeitado, pasta %s deletada", request.timestamp)
         return {"success": True, "message": f"Lote {request.timestamp} rejeitado e deletado", "timestamp": request.timestamp}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"\n❌ Erro: {str(e)}")
+        logger.exception("❌ Erro ao rejeitar lote: %s", e)
         raise HTTPException(status_code=500, detail=f"Erro ao rejeitar: {str(e)}")
 
-@app.get("/health")
-def health_check():
+def check_supabase_connection() -> bool:
+    global _last_supabase_ok
+    # Probes frequentes reaproveitam o último sucesso recente em vez de ir ao Storage
+    if time.monotonic() - _last_supabase_ok < HEALTH_CACHE_TTL_SECONDS:
+        return True
     try:
-        supabase.storage.from_(SUPABASE_BUCKET_TEMP).list()
-        supabase_status = True
+        supabase.storage.from_(SUPABASE_BUCKET_TEMP).list(options={"limit": 1})
+        _last_supabase_ok = time.monotonic()
+        return True
     except Exception:
-        supabase_status = False
-    return {"status": "healthy", "supabase_connected": supabase_status, "version": "2.2.1"}
+        return False
+
+@app.get("/health")
+def health_check():
+    return {"status": "healthy", "supabase_connected": check_supabase_connection(), "version": "2.2.1"}
+
+@app.get("/health/live")
+async def health_live():
+    # Liveness: só confirma que o processo responde, sem ida ao Supabase
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+def health_ready():
+    if not check_supabase_connection():
+        raise HTTPException(status_code=503, detail="Supabase indisponível")
+    return {"status": "ready", "supabase_connected": True}
 
 if __name__ == "__main__":
     import uvicorn
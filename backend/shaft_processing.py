@@ -15,8 +15,13 @@ import cv2
 import numpy as np
 import math
 import os
+import logging
+import threading
+from functools import lru_cache
 from typing import Tuple, List, Dict, Any, Optional, Union
 
+logger = logging.getLogger("hawkeye")
+
 # ===================== CONFIGURAÇÕES GLOBAIS =====================
 
 # Intervalo HSV para pins amarelos
@@ -51,6 +56,18 @@ MIN_AREA_SHAFT = 10
 MAX_ADJUST_DEG = 8.0
 MIN_EFFECTIVE_ROT = 0.01
 
+# Degradê da borda por tamanho de imagem: (h, w) -> (máscara de origem, região, fade, 1 - fade)
+# Cada entrada ocupa alguns buffers do tamanho da imagem, então só os tamanhos mais recentes ficam
+_BORDER_FADE_CACHE: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = {}
+# Sem o pool de processos o pipeline roda em várias threads ao mesmo tempo
+_BORDER_FADE_CACHE_LOCK = threading.Lock()
+BORDER_FADE_CACHE_MAX_SHAPES = 4
+
+# Elementos estruturantes (erosão da borda, expansão dos pins, limpeza das hastes)
+KERNEL_BORDER_ERODE = cv2.getStructuringElement(cv2.MORPH_RECT, (11, 11))
+KERNEL_PIN_DILATE = np.ones((7, 7), np.uint8)
+KERNEL_SHAFT_MORPH = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
 
 # ===================== FUNÇÕES AUXILIARES - GEOMETRIA =====================
 
@@ -278,23 +295,41 @@ def revert_transformation(
                                    flags=cv2.INTER_LINEAR, borderValue=(0,0,0))
     
     # Colocar ROI revertida sobre background original
-    final = original_background.copy()
-    mask_bool = (mask_original > 0)
-    
     # Aplicar apenas onde a máscara original permite (na região da placa)
     # Se a reconstrução for preta (0,0,0) por causa da borda, mantemos o fundo original?
     # A lógica da Etapa 4 sobrepõe tudo onde mask_bool é True.
-    final[mask_bool] = reconstructed[mask_bool]
+    # O fundo é copiado sobre a própria reconstrução (fora da máscara), sem cópia extra da imagem.
+    mask_bool = (mask_original > 0)
+    final = reconstructed
+    np.copyto(final, original_background, where=~mask_bool[:, :, None])
     
     return final
 
 
 # ===================== ETAPAS 1-7: PROCESSAMENTO DE IMAGEM =====================
 
-def remove_border_with_mask(image_bgr: np.ndarray, border_mask: Optional[np.ndarray] = None) -> np.ndarray:
-    h, w = image_bgr.shape[:2]
-    if border_mask is None:
-        return image_bgr.copy()
+@lru_cache(maxsize=8)
+def load_border_mask(path: str, mtime: float) -> Optional[np.ndarray]:
+    """Lê a máscara de borda uma vez por (caminho, data de modificação), sempre o mesmo array."""
+    mask = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if mask is not None:
+        mask.setflags(write=False)
+    return mask
+
+def border_fade_for_shape(border_mask: np.ndarray, h: int, w: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Região da borda e pesos do degradê para um tamanho de imagem.
+
+    Só depende da máscara e do tamanho, então é calculado uma vez por (h, w) e reaproveitado;
+    o cache guarda a máscara de origem e é refeito se outra máscara for usada. Os tamanhos
+    menos usados recentemente saem quando passa de BORDER_FADE_CACHE_MAX_SHAPES.
+    A comparação é por identidade: máscaras passadas por caminho vêm de load_border_mask,
+    que devolve o mesmo array enquanto o arquivo não muda.
+    """
+    with _BORDER_FADE_CACHE_LOCK:
+        cached = _BORDER_FADE_CACHE.pop((h, w), None)
+        if cached is not None and cached[0] is border_mask:
+            _BORDER_FADE_CACHE[(h, w)] = cached
+            return cached[1:]
     
     # Garante que a máscara bata com o tamanho da imagem (importante se houve conversões)
     if border_mask.shape[:2] != (h, w):
@@ -308,8 +343,7 @@ def remove_border_with_mask(image_bgr: np.ndarray, border_mask: Optional[np.ndar
         gray = mask_resized
         
     _, mask_white = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
-    kernel_2px = cv2.getStructuringElement(cv2.MORPH_RECT, (11, 11))
-    mask_white = cv2.erode(mask_white, kernel_2px)
+    mask_white = cv2.erode(mask_white, KERNEL_BORDER_ERODE)
     mask_bin = (mask_white == 0).astype(np.uint8)
     
     dist_float = cv2.distanceTransform(mask_bin, cv2.DIST_L2, 5)
@@ -319,6 +353,22 @@ def remove_border_with_mask(image_bgr: np.ndarray, border_mask: Optional[np.ndar
     
     fade_expanded = fade[:, :, None]
     fade_inv = 1.0 - fade_expanded
+    mask_indices = (mask_bin == 1)
+    for array in (fade_expanded, fade_inv, mask_indices):
+        array.setflags(write=False)
+    
+    with _BORDER_FADE_CACHE_LOCK:
+        _BORDER_FADE_CACHE[(h, w)] = (border_mask, mask_indices, fade_expanded, fade_inv)
+        while len(_BORDER_FADE_CACHE) > BORDER_FADE_CACHE_MAX_SHAPES:
+            _BORDER_FADE_CACHE.pop(next(iter(_BORDER_FADE_CACHE)))
+    return mask_indices, fade_expanded, fade_inv
+
+def remove_border_with_mask(image_bgr: np.ndarray, border_mask: Optional[np.ndarray] = None) -> np.ndarray:
+    h, w = image_bgr.shape[:2]
+    if border_mask is None:
+        return image_bgr.copy()
+    
+    mask_indices, fade_expanded, fade_inv = border_fade_for_shape(border_mask, h, w)
     
     texture = fbm_noise(h, w)
     diff = UPPER_BG - LOWER_BG
@@ -329,7 +379,6 @@ def remove_border_with_mask(image_bgr: np.ndarray, border_mask: Optional[np.ndar
     grad = np.clip(grad, 0, 255).astype(np.uint8)
     
     result = image_bgr.copy()
-    mask_indices = (mask_bin == 1)
     result[mask_indices] = grad[mask_indices]
     
     return result
@@ -406,8 +455,7 @@ def remove_pin_bodies(image_bgr: np.ndarray) -> np.ndarray:
         if cv2.contourArea(contour) > MIN_AREA_PIN:
             cv2.drawContours(filtered_mask, [contour], -1, 255, -1)
             
-    kernel = np.ones((7, 7), np.uint8)
-    expanded_mask = cv2.dilate(filtered_mask, kernel, iterations=1)
+    expanded_mask = cv2.dilate(filtered_mask, KERNEL_PIN_DILATE, iterations=1)
     mask_bin = (expanded_mask == 255).astype(np.uint8)
     
     dist_float = cv2.distanceTransform(mask_bin, cv2.DIST_L2, 5)
@@ -477,9 +525,8 @@ def apply_shaft_mask(image_bgr: np.ndarray, shaft_mask: np.ndarray) -> np.ndarra
 def segment_shafts(image_bgr: np.ndarray) -> Tuple[np.ndarray, List[np.ndarray]]:
     gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
     _, mask = cv2.threshold(gray, 50, 255, cv2.THRESH_BINARY)
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=1)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, KERNEL_SHAFT_MORPH, iterations=1)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, KERNEL_SHAFT_MORPH, iterations=1)
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     filtered_contours = [cnt for cnt in contours if cv2.contourArea(cnt) >= MIN_AREA_SHAFT]
     return mask, filtered_contours
@@ -548,8 +595,9 @@ def process_shafts_complete(
     """
     
     # 0. Preparação da imagem original e variáveis de estado
-    original_input = image_bgr.copy()
-    current_image = image_bgr.copy()
+    # Sem cópias: a entrada é só lida, cada etapa devolve uma imagem nova
+    original_input = image_bgr
+    current_image = image_bgr
     M_total = np.eye(3, dtype=np.float64)
     mask_original_roi = np.ones(image_bgr.shape[:2], dtype=np.uint8) * 255
     
@@ -557,9 +605,9 @@ def process_shafts_complete(
     loaded_border_mask = None
     if isinstance(border_mask, str):
         if os.path.exists(border_mask):
-            loaded_border_mask = cv2.imread(border_mask)
+            loaded_border_mask = load_border_mask(border_mask, os.path.getmtime(border_mask))
         else:
-            print(f"AVISO: Máscara não encontrada no caminho: {border_mask}")
+            logger.warning("AVISO: Máscara não encontrada no caminho: %s", border_mask)
     elif isinstance(border_mask, np.ndarray):
         loaded_border_mask = border_mask
 
@@ -587,8 +635,8 @@ def process_shafts_complete(
     shafts = apply_secondary_parameter(shafts)
     
     # 5. Desenho dos Resultados
-    # Usamos uma cópia da imagem atual (processada) para desenhar as anotações
-    visual_processed = current_image.copy()
+    # Desenha sobre a imagem atual (processada); copia apenas se ela ainda for a própria entrada
+    visual_processed = current_image.copy() if current_image is image_bgr else current_image
     
     for shaft in shafts:
         cnt = shaft['contour']
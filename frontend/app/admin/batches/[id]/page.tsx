@@ -121,7 +121,8 @@ export default function BatchDetailPage({ params }: { params: Promise<{ id: stri
                             const response = await fetch(img.url)
                             if (response.ok) {
                                 const blob = await response.blob()
-                                captureFolder.file(`${img.name}.png`, blob)
+                                const extension = img.url.split('?')[0].split('.').pop() || 'png'
+                                captureFolder.file(`${img.name}.${extension}`, blob)
                             }
                         } catch (err) {
                             console.warn(`Erro ao baixar ${img.name}:`, err)